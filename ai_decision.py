@@ -3,10 +3,17 @@ AI decision layer - uses LLM to analyze intent and risk.
 This is advisory only; rules can override it.
 """
 
-import json
+import orjson
 import logging
-from typing import Optional
-from models import DecisionRequest, DecisionResponse, Decision, Priority
+import re
+import hashlib
+import time
+import os
+import asyncio
+from collections import OrderedDict
+from typing import Optional, Set, Tuple, List
+from models import DecisionRequest, DecisionResponse, Decision, Priority, UserPlan
+from semantic_cache import semantic_cache
 import config
 
 logger = logging.getLogger(__name__)
@@ -28,31 +35,83 @@ class AIDecisionResult:
         self.recommended_action = recommended_action
         self.raw_response = raw_response
 
+    def copy(self) -> "AIDecisionResult":
+        """Return an independent copy (callers may mutate recommended_action)."""
+        return AIDecisionResult(
+            decision=self.decision,
+            priority=self.priority,
+            churn_risk=self.churn_risk,
+            recommended_action=self.recommended_action,
+            raw_response=self.raw_response
+        )
 
-def build_ai_prompt(request: DecisionRequest) -> str:
+
+class DecisionCache:
     """
-    Construct a prompt that forces structured JSON output.
-    We use few-shot examples to guide the model.
+    Bounded LRU cache of parsed AI decisions, keyed by prompt digest.
+    
+    Identical prompts (same message, plan, channel, history) skip the
+    Gemini call entirely. Entries expire after a TTL so model or prompt
+    changes roll out without a restart.
+    
+    In production, replace with Redis to share hits across workers.
     """
-    history_context = ""
-    if request.history:
-        history_context = f"\n- Previous interactions: {len(request.history)} messages"
     
-    prompt = f"""You are a customer service decision AI. Analyze the message and return ONLY valid JSON.
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, AIDecisionResult]]" = OrderedDict()
+    
+    @staticmethod
+    def make_key(prompt: str) -> str:
+        """Compact digest of the full prompt."""
+        return hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+    
+    def get(self, key: str) -> Optional[AIDecisionResult]:
+        """Return a copy of the cached result, or None on miss/expiry."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        
+        self._entries.move_to_end(key)
+        return result.copy()
+    
+    def put(self, key: str, result: AIDecisionResult):
+        """Store a result, evicting the least recently used entries."""
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, result.copy())
+        self._entries.move_to_end(key)
+        
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Drop all cached decisions."""
+        self._entries.clear()
 
-Customer Context:
-- Plan: {request.user_plan.value}
-- Channel: {request.channel.value}{history_context}
 
-Message: "{request.message}"
+# Global decision cache instance
+decision_cache = DecisionCache(
+    max_entries=config.AI_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.AI_CACHE_TTL_SECONDS
+)
+
+
+# Static instructions, sent as the model's system instruction.
+# Kept separate from per-request content so the provider can cache it.
+SYSTEM_PROMPT = """You are a customer service decision AI. Analyze the message and return ONLY valid JSON.
 
 Return this exact JSON structure:
-{{
+{
   "decision": "ignore | standard_response | priority_response | immediate_escalation",
   "priority": "low | medium | high | critical",
   "churn_risk": <float 0.0-1.0>,
   "recommended_action": "<concise action for support team>"
-}}
+}
 
 Rules:
 - Use "immediate_escalation" for urgent, angry, or legal threats
@@ -64,27 +123,40 @@ Rules:
 
 Return ONLY the JSON, no markdown, no explanation."""
 
+
+def build_ai_prompt(request: DecisionRequest) -> str:
+    """
+    Construct the per-request part of the prompt (customer context + message).
+    Output format and rules live in SYSTEM_PROMPT.
+    """
+    history_context = ""
+    if request.history:
+        history_context = f"\n- Previous interactions: {len(request.history)} messages"
+    
+    prompt = f"""Customer Context:
+- Plan: {request.user_plan.value}
+- Channel: {request.channel.value}{history_context}
+
+Message: "{request.message}"
+"""
+
     return prompt
 
 
-async def call_ai_api(prompt: str) -> Optional[str]:
+# Gemini model is configured once per process (see _get_gemini_model)
+_gemini_model = None
+
+
+def _get_gemini_model():
     """
-    Call Google Gemini API for decision analysis.
-    Uses gemini-1.5-flash for speed and cost-efficiency.
-    
-    Setup:
-    1. pip install google-generativeai
-    2. Set environment variable: GOOGLE_API_KEY=your_key_here
-    3. Or pass API key in code (not recommended for production)
-    
-    Note: The Gemini SDK doesn't have native async support yet,
-    so we run the synchronous call in an executor to avoid blocking.
+    Configure the Gemini SDK and build the model on first use.
+    Returns None if GOOGLE_API_KEY is missing.
+    Raises ImportError if google-generativeai is not installed.
     """
-    try:
+    global _gemini_model
+    
+    if _gemini_model is None:
         import google.generativeai as genai
-        import os
-        import asyncio
-        from concurrent.futures import ThreadPoolExecutor
         
         # Configure API key (from environment variable)
         api_key = os.getenv("GOOGLE_API_KEY")
@@ -96,22 +168,54 @@ async def call_ai_api(prompt: str) -> Optional[str]:
         
         # FIXED: Use the correct model name format
         # Changed from 'gemini-1.5-flash' to 'models/gemini-1.5-flash'
-        model = genai.GenerativeModel(
+        _gemini_model = genai.GenerativeModel(
             model_name='models/gemini-1.5-flash',
+            system_instruction=SYSTEM_PROMPT,
             generation_config={
                 'temperature': config.AI_TEMPERATURE,
                 'max_output_tokens': config.AI_MAX_TOKENS,
+                'response_mime_type': 'application/json',
             }
         )
+    
+    return _gemini_model
+
+
+async def call_ai_api(prompt: str, max_output_tokens: Optional[int] = None) -> Optional[str]:
+    """
+    Call Google Gemini API for decision analysis.
+    Uses gemini-1.5-flash for speed and cost-efficiency.
+    max_output_tokens overrides AI_MAX_TOKENS (used for batched prompts).
+    
+    Setup:
+    1. pip install google-generativeai
+    2. Set environment variable: GOOGLE_API_KEY=your_key_here
+    3. Or pass API key in code (not recommended for production)
+    
+    Note: The Gemini SDK doesn't have native async support yet,
+    so we run the synchronous call on the loop's default executor
+    (sized at startup via THREAD_POOL_SIZE) to avoid blocking.
+    """
+    try:
+        model = _get_gemini_model()
+        if model is None:
+            return None
         
-        # Run synchronous Gemini call in thread pool to avoid blocking
-        loop = asyncio.get_event_loop()
-        with ThreadPoolExecutor() as executor:
-            response = await loop.run_in_executor(
-                executor,
+        # Run synchronous Gemini call in thread pool to avoid blocking.
+        # wait_for bounds our latency; request_options cancels the HTTP call.
+        generation_config = None
+        if max_output_tokens:
+            generation_config = {'max_output_tokens': max_output_tokens}
+        
+        response = await asyncio.wait_for(
+            asyncio.to_thread(
                 model.generate_content,
-                prompt
-            )
+                prompt,
+                generation_config=generation_config,
+                request_options={'timeout': config.AI_TIMEOUT_SECONDS}
+            ),
+            timeout=config.AI_TIMEOUT_SECONDS
+        )
         
         if not response or not response.text:
             logger.error("Gemini returned empty response")
@@ -122,36 +226,183 @@ async def call_ai_api(prompt: str) -> Optional[str]:
     except ImportError:
         logger.error("google-generativeai not installed. Run: pip install google-generativeai")
         return None
+    except asyncio.TimeoutError:
+        logger.error("Gemini API timed out after %ss", config.AI_TIMEOUT_SECONDS)
+        return None
     except Exception as e:
-        logger.error(f"Gemini API error: {e}")
+        logger.error("Gemini API error: %s", e)
         return None
 
 
+# Leading ```json / trailing ``` fences around a JSON payload
+MD_STRIP_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def strip_markdown(raw_response: str) -> str:
+    """
+    Remove markdown code fences some models wrap around JSON.
+    Rarely needed: the model is asked for application/json output.
+    """
+    return MD_STRIP_RE.sub("", raw_response.strip())
+
+
+def build_batch_prompt(prompts: List[str]) -> str:
+    """Combine independent decision prompts into one request returning a JSON array."""
+    tasks = "\n\n".join(
+        f"### Task {i}\n{prompt}" for i, prompt in enumerate(prompts, start=1)
+    )
+    
+    return f"""You will receive {len(prompts)} independent decision tasks. Complete each one separately.
+
+Return ONLY a JSON array with exactly {len(prompts)} objects, one per task, in task order.
+Each object must follow the JSON structure from your instructions.
+
+{tasks}"""
+
+
+def split_batch_response(raw_response: str, count: int) -> List[Optional[str]]:
+    """
+    Split a batched JSON array into one JSON string per task.
+    Returns a list of None if the array is malformed.
+    """
+    try:
+        parsed = orjson.loads(strip_markdown(raw_response))
+    except orjson.JSONDecodeError as e:
+        logger.error("AI batch JSON parse error: %s", e)
+        return [None] * count
+    
+    if not isinstance(parsed, list) or len(parsed) != count:
+        logger.error("AI batch returned %s instead of %d decisions", type(parsed).__name__, count)
+        return [None] * count
+    
+    return [orjson.dumps(item).decode() for item in parsed]
+
+
+class DecisionBatcher:
+    """
+    Coalesces concurrent prompts into a single Gemini call.
+    
+    The first prompt opens a window of AI_BATCH_MAX_WAIT_MS; everything
+    queued before it closes (up to AI_BATCH_MAX_SIZE) is sent as one
+    request and the JSON array is split back per caller.
+    A lone prompt is sent unchanged.
+    """
+    
+    def __init__(self, max_batch: int, max_wait_ms: float):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        
+        # The event loop only keeps weak references to tasks, so hold them
+        # here or the collector could be garbage-collected mid-await
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+    
+    def _ensure_worker(self):
+        """Start the collector task on the current event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._collect())
+    
+    async def submit(self, prompt: str) -> Optional[str]:
+        """Queue a prompt and wait for its raw JSON response."""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put((prompt, future))
+        return await future
+    
+    async def _collect(self):
+        """Drain the queue into batches and dispatch them."""
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Don't hold up the next window while this batch is in flight
+            task = loop.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+    
+    async def _dispatch(self, batch: List[Tuple[str, asyncio.Future]]):
+        """Send one batch to Gemini and resolve each caller's future."""
+        prompts = [prompt for prompt, _ in batch]
+        
+        try:
+            if len(prompts) == 1:
+                responses = [await call_ai_api(prompts[0])]
+            else:
+                raw_response = await call_ai_api(
+                    build_batch_prompt(prompts),
+                    max_output_tokens=config.AI_MAX_TOKENS * len(prompts)
+                )
+                if raw_response:
+                    responses = split_batch_response(raw_response, len(prompts))
+                else:
+                    responses = [None] * len(prompts)
+        except Exception as e:
+            logger.error("AI batch dispatch failed: %s", e)
+            responses = [None] * len(prompts)
+        
+        for (_, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
+
+
+# Global batcher instance (used when AI_BATCH_ENABLED)
+decision_batcher = DecisionBatcher(
+    max_batch=config.AI_BATCH_MAX_SIZE,
+    max_wait_ms=config.AI_BATCH_MAX_WAIT_MS
+)
+
+
 async def get_ai_decision(request: DecisionRequest) -> Optional[AIDecisionResult]:
     """
     Main AI decision function.
     Returns None if AI fails (triggers fallback in main logic).
+    Identical prompts are served from the decision cache;
+    near-duplicate messages from the semantic cache (if enabled).
     """
     try:
         # Build prompt
         prompt = build_ai_prompt(request)
         
-        # Call AI (with timeout)
-        raw_response = await call_ai_api(prompt)
+        # Serve repeats without calling the AI
+        cache_key = decision_cache.make_key(prompt)
+        cached = decision_cache.get(cache_key)
+        if cached:
+            return cached
+        
+        cached = await semantic_cache.lookup(request)
+        if cached:
+            decision_cache.put(cache_key, cached)
+            return cached
+        
+        # Call AI (with timeout, see config.AI_TIMEOUT_SECONDS)
+        if config.AI_BATCH_ENABLED:
+            raw_response = await decision_batcher.submit(prompt)
+        else:
+            raw_response = await call_ai_api(prompt)
         
         if not raw_response:
             return None
         
         # Parse JSON
         # Handle markdown code blocks if present (some models add them)
-        cleaned_response = raw_response.strip()
-        if cleaned_response.startswith("```"):
-            # Extract JSON from markdown block
-            lines = cleaned_response.split("\n")
-            json_lines = [l for l in lines if not l.startswith("```")]
-            cleaned_response = "\n".join(json_lines).strip()
-        
-        parsed = json.loads(cleaned_response)
+        cleaned_response = strip_markdown(raw_response)
+        parsed = orjson.loads(cleaned_response)
         
         # Validate and extract fields
         decision = Decision(parsed["decision"])
@@ -166,7 +417,7 @@ async def get_ai_decision(request: DecisionRequest) -> Optional[AIDecisionResult
         if len(recommended_action) > 500:
             recommended_action = recommended_action[:497] + "..."
         
-        return AIDecisionResult(
+        result = AIDecisionResult(
             decision=decision,
             priority=priority,
             churn_risk=churn_risk,
@@ -174,17 +425,22 @@ async def get_ai_decision(request: DecisionRequest) -> Optional[AIDecisionResult
             raw_response=raw_response
         )
         
-    except json.JSONDecodeError as e:
+        decision_cache.put(cache_key, result)
+        await semantic_cache.store(request, result)
+        
+        return result
+        
+    except orjson.JSONDecodeError as e:
         # AI returned invalid JSON
-        print(f"AI JSON parse error: {e}")
+        logger.warning("AI JSON parse error: %s", e)
         return None
     except (KeyError, ValueError) as e:
         # AI returned JSON but wrong schema
-        print(f"AI schema validation error: {e}")
+        logger.warning("AI schema validation error: %s", e)
         return None
     except Exception as e:
         # Network timeout, API error, etc.
-        print(f"AI call failed: {e}")
+        logger.warning("AI call failed: %s", e)
         return None
 
 
@@ -193,7 +449,7 @@ def get_fallback_decision(request: DecisionRequest) -> AIDecisionResult:
     If AI fails, return a safe conservative decision.
     Enterprise customers get priority, others get standard response.
     """
-    if request.user_plan.value == "enterprise":
+    if request.user_plan is UserPlan.ENTERPRISE:
         return AIDecisionResult(
             decision=Decision.PRIORITY_RESPONSE,
             priority=Priority.HIGH,
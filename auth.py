@@ -3,10 +3,16 @@ API Key Authentication System
 Manages API keys, user tiers, and authentication.
 """
 
+import asyncio
+import os
 import secrets
 import hashlib
-from datetime import datetime, timedelta
-from typing import Optional, Dict
+import re
+import time
+from functools import cached_property, lru_cache
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional, Dict, Tuple, Set, cast
+from collections import defaultdict
 from enum import Enum
 from pydantic import BaseModel
 
@@ -27,12 +33,17 @@ class APIKey(BaseModel):
     created_at: datetime
     requests_today: int = 0
     requests_this_month: int = 0
-    last_request_at: Optional[datetime] = None
+    last_request_at: Optional[int] = None  # Unix timestamp (seconds)
     is_active: bool = True
     
     # Metadata
     name: Optional[str] = None  # e.g., "Production API", "Development"
     email: Optional[str] = None
+    
+    @cached_property
+    def limits(self) -> "TierLimits":
+        """Rate limits for this key's tier (resolved once per key object)."""
+        return TIER_LIMITS[self.tier]
 
 
 class TierLimits(BaseModel):
@@ -87,33 +98,50 @@ def generate_test_api_key() -> str:
     return f"sk_test_{random_part}"
 
 
+# sk_live_ or sk_test_ followed by a URL-safe random part of 31-64 chars
+# (generated keys have 43; the shortest seeded demo key, demo-pro, has 31)
+API_KEY_RE = re.compile(r"sk_(live|test)_[A-Za-z0-9_-]{31,64}")
+MAX_API_KEY_LENGTH = len("sk_live_") + 64
+
+
+@lru_cache(maxsize=4096)
 def hash_api_key(api_key: str) -> str:
     """
     Hash API key for secure storage.
     Never store raw keys in database.
+    
+    Memoized: the same few keys authenticate on every request.
+    The cache is bounded and cleared whenever a key is deactivated.
+    
+    BLAKE2b (32-byte digest) is faster than SHA-256 for short inputs
+    and keeps the same 64-char hex length.
     """
-    return hashlib.sha256(api_key.encode()).hexdigest()
+    return hashlib.blake2b(api_key.encode(), digest_size=32).hexdigest()
 
 
 def verify_api_key_format(api_key: str) -> bool:
-    """Validate API key format."""
-    if not api_key:
-        return False
-    
-    # Must start with sk_live_ or sk_test_
-    if not (api_key.startswith("sk_live_") or api_key.startswith("sk_test_")):
-        return False
-    
-    # Must have the random part
-    parts = api_key.split("_")
-    if len(parts) != 3:
-        return False
+    """
+    Validate API key format.
     
-    # Random part should be long enough
-    if len(parts[2]) < 32:
+    Oversized input is rejected before the memoized match, so junk
+    headers can't pin large strings in the cache.
+    """
+    if not api_key or len(api_key) > MAX_API_KEY_LENGTH:
         return False
     
-    return True
+    return _matches_api_key_format(api_key)
+
+
+@lru_cache(maxsize=4096)
+def _matches_api_key_format(api_key: str) -> bool:
+    """Memoized like hash_api_key and cleared with it (clear_raw_key_caches)."""
+    return API_KEY_RE.fullmatch(api_key) is not None
+
+
+def clear_raw_key_caches():
+    """Drop memoized raw keys (both caches above)."""
+    hash_api_key.cache_clear()
+    _matches_api_key_format.cache_clear()
 
 
 class APIKeyStore:
@@ -122,16 +150,23 @@ class APIKeyStore:
     
     In production, replace with:
     - PostgreSQL/MySQL for persistent storage
-    - Redis for fast lookups and rate limiting
+    - Redis for fast lookups and rate limiting (see RedisAPIKeyStore)
     - Add indexes on key_hash for performance
     """
     
+    blocking_io = False  # True if methods do network I/O (see run_store_call)
+    
     def __init__(self):
         self.keys: Dict[str, APIKey] = {}
+        self.by_user: Dict[str, Set[str]] = defaultdict(set)  # user_id -> key hashes
         self._initialize_demo_keys()
     
     def _initialize_demo_keys(self):
-        """Create demo API keys for testing."""
+        """
+        Create demo API keys for testing.
+        Existing records are left alone, so a shared store keeps their
+        usage and deactivation across restarts.
+        """
         demo_keys = [
             ("sk_test_demo_free_key_12345678901234567890", "demo-free", Tier.FREE, "demo-free@example.com"),
             ("sk_test_demo_starter_key_1234567890123456", "demo-starter", Tier.STARTER, "demo-starter@example.com"),
@@ -140,14 +175,22 @@ class APIKeyStore:
         
         for key, user_id, tier, email in demo_keys:
             key_hash = hash_api_key(key)
-            self.keys[key_hash] = APIKey(
+            if self.get_key_by_hash(key_hash) is not None:
+                continue
+            
+            self._save(APIKey(
                 key_hash=key_hash,
                 user_id=user_id,
                 tier=tier,
                 created_at=datetime.utcnow(),
                 email=email,
                 name=f"Demo {tier.value.title()} Key"
-            )
+            ))
+    
+    def _save(self, api_key: APIKey):
+        """Persist an API key record."""
+        self.keys[api_key.key_hash] = api_key
+        self.by_user[api_key.user_id].add(api_key.key_hash)
     
     def create_key(
         self,
@@ -166,14 +209,14 @@ class APIKeyStore:
         key_hash = hash_api_key(raw_key)
         
         # Store hashed version
-        self.keys[key_hash] = APIKey(
+        self._save(APIKey(
             key_hash=key_hash,
             user_id=user_id,
             tier=tier,
             created_at=datetime.utcnow(),
             email=email,
             name=name
-        )
+        ))
         
         return raw_key  # Return only once
     
@@ -183,7 +226,7 @@ class APIKeyStore:
             return None
         
         key_hash = hash_api_key(raw_key)
-        return self.keys.get(key_hash)
+        return self.get_key_by_hash(key_hash)
     
     def get_key_by_hash(self, key_hash: str) -> Optional[APIKey]:
         """Retrieve API key by hash (for internal use)."""
@@ -195,7 +238,17 @@ class APIKeyStore:
             key = self.keys[key_hash]
             key.requests_today += 1
             key.requests_this_month += 1
-            key.last_request_at = datetime.utcnow()
+            key.last_request_at = int(time.time())
+    
+    def bulk_update_usage(self, counts: Dict[str, int]):
+        """Apply batched usage increments (key_hash -> request count)."""
+        now = int(time.time())
+        for key_hash, count in counts.items():
+            key = self.keys.get(key_hash)
+            if key:
+                key.requests_today += count
+                key.requests_this_month += count
+                key.last_request_at = now
     
     def reset_daily_counters(self):
         """Reset daily request counters (run via cron at midnight)."""
@@ -211,11 +264,186 @@ class APIKeyStore:
         """Deactivate an API key."""
         if key_hash in self.keys:
             self.keys[key_hash].is_active = False
+        
+        # Don't keep raw keys around longer than necessary
+        clear_raw_key_caches()
+    
+    def list_keys_by_user(self, user_id: str) -> list[APIKey]:
+        """Get all keys for a user (including deactivated keys)."""
+        return [self.keys[key_hash] for key_hash in self.by_user.get(user_id, ())]
+
+
+class RedisAPIKeyStore(APIKeyStore):
+    """
+    Redis-backed key store shared by all workers/processes.
+    
+    Layout:
+    - apikey:{hash}                  hash of key metadata
+    - apikey:{hash}:day:{YYYYMMDD}   request counter, expires at next midnight UTC
+    - apikey:{hash}:month:{YYYYMM}   request counter, expires at next month UTC
+    - apikeys:user:{user_id}         set of key hashes owned by the user
+    
+    Counters are per-period keys, so daily/monthly resets happen
+    automatically via expiry instead of a loop over every key.
+    
+    Calls are blocking, so async code goes through run_store_call
+    (thread pool) instead of calling methods directly.
+    
+    Requires: pip install redis
+    """
+    
+    blocking_io = True
+    
+    def __init__(self, redis_url: str):
+        try:
+            import redis  # type: ignore[import-not-found]  # optional extra
+        except ImportError as e:
+            raise ImportError("REDIS_URL is set but redis is not installed. Run: pip install redis") from e
+        
+        # Any: redis-py's annotations vary by version (from_url is typed
+        # "-> None" in 5.0.x) and would break the mypyc build of rate_limit.py
+        self.redis: Any = redis.Redis.from_url(redis_url, decode_responses=True)
+        self.keys = {}  # Unused; records live in Redis
+        self._initialize_demo_keys()
+    
+    @staticmethod
+    def _record_key(key_hash: str) -> str:
+        return f"apikey:{key_hash}"
+    
+    @staticmethod
+    def _user_index_key(user_id: str) -> str:
+        return f"apikeys:user:{user_id}"
+    
+    @staticmethod
+    def _counter_keys(key_hash: str, now: int) -> Tuple[str, int, str, int]:
+        """Return (day_key, day_expires_at, month_key, month_expires_at)."""
+        today = datetime.utcfromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        tomorrow = today + timedelta(days=1)
+        
+        if today.month == 12:
+            next_month = today.replace(year=today.year + 1, month=1, day=1)
+        else:
+            next_month = today.replace(month=today.month + 1, day=1)
+        
+        return (
+            f"apikey:{key_hash}:day:{today:%Y%m%d}",
+            int(tomorrow.replace(tzinfo=timezone.utc).timestamp()),
+            f"apikey:{key_hash}:month:{today:%Y%m}",
+            int(next_month.replace(tzinfo=timezone.utc).timestamp())
+        )
+    
+    def _save(self, api_key: APIKey):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(self._record_key(api_key.key_hash), mapping={
+            "user_id": api_key.user_id,
+            "tier": api_key.tier.value,
+            "created_at": api_key.created_at.isoformat(),
+            "is_active": int(api_key.is_active),
+            "name": api_key.name or "",
+            "email": api_key.email or "",
+        })
+        pipe.sadd(self._user_index_key(api_key.user_id), api_key.key_hash)
+        pipe.execute()
+    
+    def get_key_by_hash(self, key_hash: str) -> Optional[APIKey]:
+        day_key, _, month_key, _ = self._counter_keys(key_hash, int(time.time()))
+        
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(self._record_key(key_hash))
+        pipe.get(day_key)
+        pipe.get(month_key)
+        record, requests_today, requests_this_month = pipe.execute()
+        
+        if not record:
+            return None
+        
+        return APIKey(
+            key_hash=key_hash,
+            user_id=record["user_id"],
+            tier=Tier(record["tier"]),
+            created_at=datetime.fromisoformat(record["created_at"]),
+            requests_today=int(requests_today or 0),
+            requests_this_month=int(requests_this_month or 0),
+            last_request_at=int(record["last_request_at"]) if record.get("last_request_at") else None,
+            is_active=record["is_active"] == "1",
+            name=record["name"] or None,
+            email=record["email"] or None
+        )
+    
+    def update_usage(self, key_hash: str):
+        now = int(time.time())
+        day_key, day_expires_at, month_key, month_expires_at = self._counter_keys(key_hash, now)
+        
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.incr(day_key)
+        pipe.expireat(day_key, day_expires_at)
+        pipe.incr(month_key)
+        pipe.expireat(month_key, month_expires_at)
+        pipe.hset(self._record_key(key_hash), "last_request_at", now)
+        pipe.execute()
+    
+    def bulk_update_usage(self, counts: Dict[str, int]):
+        now = int(time.time())
+        
+        pipe = self.redis.pipeline(transaction=False)
+        for key_hash, count in counts.items():
+            day_key, day_expires_at, month_key, month_expires_at = self._counter_keys(key_hash, now)
+            pipe.incrby(day_key, count)
+            pipe.expireat(day_key, day_expires_at)
+            pipe.incrby(month_key, count)
+            pipe.expireat(month_key, month_expires_at)
+            pipe.hset(self._record_key(key_hash), "last_request_at", now)
+        pipe.execute()
+    
+    def _delete_matching(self, pattern: str):
+        for key in self.redis.scan_iter(match=pattern, count=1000):
+            self.redis.delete(key)
+    
+    def reset_daily_counters(self):
+        """Not needed on schedule (counters expire); forces a reset of today's counters."""
+        self._delete_matching(f"apikey:*:day:{datetime.utcnow():%Y%m%d}")
+    
+    def reset_monthly_counters(self):
+        """Not needed on schedule (counters expire); forces a reset of this month's counters."""
+        self._delete_matching(f"apikey:*:month:{datetime.utcnow():%Y%m}")
+    
+    def deactivate_key(self, key_hash: str):
+        record_key = self._record_key(key_hash)
+        if self.redis.exists(record_key):
+            self.redis.hset(record_key, "is_active", 0)
+        
+        # Don't keep raw keys around longer than necessary
+        clear_raw_key_caches()
     
     def list_keys_by_user(self, user_id: str) -> list[APIKey]:
-        """Get all keys for a user."""
-        return [k for k in self.keys.values() if k.user_id == user_id]
+        keys = []
+        # decode_responses=True: members come back as str, not bytes
+        key_hashes = cast(Set[str], self.redis.smembers(self._user_index_key(user_id)))
+        for key_hash in key_hashes:
+            api_key = self.get_key_by_hash(key_hash)
+            if api_key:
+                keys.append(api_key)
+        return keys
+
+
+def _create_key_store() -> APIKeyStore:
+    """Use Redis when REDIS_URL is configured, otherwise keep keys in memory."""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        return RedisAPIKeyStore(redis_url)
+    return APIKeyStore()
 
 
 # Global key store instance
-api_key_store = APIKeyStore()
\ No newline at end of file
+api_key_store = _create_key_store()
+
+
+async def run_store_call(method, *args, **kwargs):
+    """
+    Call a key store method from async code.
+    Network-backed stores (Redis) run on the default executor so a
+    round-trip never blocks the event loop; in-memory calls run inline.
+    """
+    if api_key_store.blocking_io:
+        return await asyncio.to_thread(method, *args, **kwargs)
+    return method(*args, **kwargs)
\ No newline at end of file
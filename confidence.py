@@ -3,13 +3,19 @@ Confidence scoring - combines rule signals and AI certainty.
 Higher confidence = more reliable decision.
 """
 
+import math
 from typing import List
-from models import DecisionRequest
+from models import DecisionRequest, UserPlan, Decision
 from rules import RuleResult
 from ai_decision import AIDecisionResult
 import config
 
 
+# Decisions that agree with a high / low churn risk
+_ESCALATION_DECISIONS = frozenset({Decision.PRIORITY_RESPONSE, Decision.IMMEDIATE_ESCALATION})
+_CALM_DECISIONS = frozenset({Decision.IGNORE, Decision.STANDARD_RESPONSE})
+
+
 def calculate_confidence(
     request: DecisionRequest,
     rule_results: List[RuleResult],
@@ -19,52 +25,59 @@ def calculate_confidence(
     """
     Calculate confidence score (0.0 - 1.0) based on multiple signals.
     
+    Each factor is a sub-score in (0, 1] (0.5 = neutral) and the result is
+    their geometric mean, so a single weak signal (e.g. AI failure) pulls
+    the score down instead of being masked by unrelated boosts.
+    
     Factors:
     1. Rule matches (strong signal)
     2. Message clarity (length, structure)
     3. AI availability (penalty if failed)
     4. History (more context = higher confidence)
+    5. Enterprise plan (more context assumed)
+    6. Churn risk / decision alignment
     """
     
-    confidence = 0.5  # Base confidence
-    
     # Factor 1: Rule boost
-    for rule in rule_results:
-        confidence += rule.confidence_boost
+    rule_factor = min(1.0, 0.5 + 2 * sum(rule.confidence_boost for rule in rule_results))
     
-    # Factor 2: Message quality
-    message_length = len(request.message.strip())
+    # Factor 2: Message quality (message is already stripped by DecisionRequest)
+    message = request.message
+    message_length = len(message)
     if message_length > 100:
-        confidence += 0.1  # Detailed message = clearer intent
+        length_factor = 0.7  # Detailed message = clearer intent
     elif message_length < 30:
-        confidence -= 0.1  # Very short = ambiguous
+        length_factor = 0.3  # Very short = ambiguous
+    else:
+        length_factor = 0.5
     
     # Check for question marks (questions are clearer intent)
-    if "?" in request.message:
-        confidence += 0.05
+    if "?" in message:
+        length_factor += 0.1
     
-    # Factor 3: AI availability penalty
-    if ai_failed:
-        confidence -= 0.2  # Significant penalty for AI failure
+    # Factor 3: AI availability penalty (neutral when the AI answered)
+    ai_factor = 0.1 if ai_failed else 0.5  # Significant penalty for AI failure
     
     # Factor 4: History context
-    if request.history and len(request.history) > 0:
-        history_boost = min(0.15, len(request.history) * 0.03)
-        confidence += history_boost
+    history = request.history
+    history_factor = 0.5 + min(0.3, len(history) * 0.06) if history else 0.5
     
     # Factor 5: Enterprise customers (more context assumed)
-    if request.user_plan.value == "enterprise":
-        confidence += 0.1
+    plan_factor = 0.7 if request.user_plan is UserPlan.ENTERPRISE else 0.5
     
     # Factor 6: Churn risk alignment
     # High churn risk with escalation decision = good alignment
-    if ai_result.churn_risk > 0.7 and ai_result.decision.value in ["priority_response", "immediate_escalation"]:
-        confidence += 0.1
-    elif ai_result.churn_risk < 0.3 and ai_result.decision.value in ["ignore", "standard_response"]:
-        confidence += 0.05
+    churn_risk = ai_result.churn_risk
+    decision = ai_result.decision
+    if churn_risk > 0.7 and decision in _ESCALATION_DECISIONS:
+        alignment_factor = 0.7
+    elif churn_risk < 0.3 and decision in _CALM_DECISIONS:
+        alignment_factor = 0.6
+    else:
+        alignment_factor = 0.5
     
-    # Clamp to valid range
-    confidence = max(0.0, min(1.0, confidence))
+    factors = (rule_factor, length_factor, ai_factor, history_factor, plan_factor, alignment_factor)
+    confidence = math.prod(factors) ** (1.0 / len(factors))
     
     return round(confidence, 2)
 
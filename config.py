@@ -24,6 +24,12 @@ SPAM_INDICATORS: Set[str] = {
 MIN_MESSAGE_LENGTH = 10  # Characters (after strip)
 SPAM_MAX_LENGTH = 20  # Very short messages are likely spam/noise
 
+# History rule: (minimum prior interactions, confidence boost), highest first
+HISTORY_CONFIDENCE_TIERS = [
+    (5, 0.15),
+    (3, 0.1),
+]
+
 # Confidence thresholds
 LOW_CONFIDENCE_THRESHOLD = 0.4
 MEDIUM_CONFIDENCE_THRESHOLD = 0.7
@@ -33,6 +39,25 @@ AI_TEMPERATURE = 0.2  # Low temperature for deterministic output
 AI_TIMEOUT_SECONDS = 10
 AI_MAX_TOKENS = 500
 
+# AI response cache (exact prompt match)
+AI_CACHE_MAX_ENTRIES = 10000
+AI_CACHE_TTL_SECONDS = 3600  # 1 hour
+
+# AI request batching (coalesce concurrent prompts into one Gemini call)
+AI_BATCH_ENABLED = False  # Off by default: batching changes the prompt shape
+AI_BATCH_MAX_SIZE = 16
+AI_BATCH_MAX_WAIT_MS = 20
+
+# Semantic cache (near-duplicate messages, requires sentence-transformers)
+SEMANTIC_CACHE_ENABLED = False
+SEMANTIC_CACHE_MODEL = "all-MiniLM-L6-v2"
+SEMANTIC_CACHE_THRESHOLD = 0.92  # Cosine similarity required for a hit
+SEMANTIC_CACHE_MAX_ENTRIES = 5000  # Per plan/channel/history partition
+
+# Usage counters are buffered and written to the key store in batches.
+# Daily/monthly limit checks and /v1/usage may lag by up to this interval.
+USAGE_FLUSH_INTERVAL_SECONDS = 0.5
+
 # Priority mapping based on plan
 PLAN_BASE_PRIORITY = {
     "free": "low",
@@ -2,7 +2,7 @@
 Decision Intelligence API - Main Application
 
 Architecture:
-1. Authentication & rate limiting (middleware)
+1. Authentication & rate limiting (router dependency)
 2. Rules run first (catch critical cases)
 3. AI analyzes (advisory layer)
 4. Validation ensures schema (safety net)
@@ -12,27 +12,37 @@ This is production-ready: defensive, predictable, and testable.
 """
 from dotenv import load_dotenv
 import os
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import ValidationError
-from models import DecisionRequest, DecisionResponse, Decision, Priority
-from dotenv import load_dotenv
-import os
-from fastapi import FastAPI, HTTPException, Request
+
+# Load environment variables from .env file
+# (before importing modules that read settings at import time, e.g. REDIS_URL)
+load_dotenv()
+
+from fastapi import APIRouter, Depends, FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from pydantic import ValidationError
-from models import DecisionRequest, DecisionResponse, Decision, Priority
-from rules import apply_rules
+from models import DecisionRequest, DecisionResponse, Decision, Priority, DECISION_RANK, PRIORITY_RANK
+from rules import apply_rules, RuleResult
 from ai_decision import get_ai_decision, get_fallback_decision
 from confidence import calculate_confidence, should_apply_confidence_fallback
-from middleware import auth_middleware
-from auth import api_key_store, Tier, TIER_LIMITS
+from middleware import (
+    AuthenticationError,
+    RateLimitError,
+    authenticate_and_rate_limit,
+    authentication_error_handler,
+    flush_usage,
+    flush_usage_loop,
+    rate_limit_error_handler
+)
+from auth import api_key_store, run_store_call, Tier, TIER_LIMITS
+from semantic_cache import semantic_cache
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Tuple
+import asyncio
 import logging
-
-# Load environment variables from .env file
-load_dotenv()
+import orjson
 
 # Load Google API Key securely from environment
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -43,17 +53,43 @@ if not GOOGLE_API_KEY:
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup / shutdown:
+    1. Size the default executor shared by blocking calls (Gemini SDK,
+       Redis, embeddings), reused across requests instead of a pool per call
+    2. Load the embedding model up front (no-op unless SEMANTIC_CACHE_ENABLED)
+    3. Write batched usage counters to the key store in the background;
+       on shutdown, stop the task and write out any usage still buffered
+    """
+    max_workers = int(os.getenv("THREAD_POOL_SIZE", "64"))
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=max_workers)
+    )
+    
+    await semantic_cache.load()
+    
+    usage_flush_task = asyncio.create_task(flush_usage_loop())
+    try:
+        yield
+    finally:
+        usage_flush_task.cancel()
+        await flush_usage()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Decision Intelligence API",
     description="AI-powered customer message triage and decision engine with API key authentication",
     version="2.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse,  # orjson serializes responses in C
+    lifespan=lifespan
 )
 
-# IMPORTANT: CORS middleware must be added BEFORE authentication middleware
-# This ensures OPTIONS requests get CORS headers before auth check
+# CORS preflights are answered here; OPTIONS routes are never authenticated
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -71,11 +107,12 @@ app.add_middleware(
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH", "HEAD"],
     allow_headers=["*"],
     expose_headers=["*"],
-    max_age=3600
+    max_age=86400  # Let browsers cache preflights for 24h (Chrome caps at 2h)
 )
 
-# Add authentication middleware AFTER CORS
-app.middleware("http")(auth_middleware)
+# Routes that require an API key. Public routes are registered on app directly,
+# so they never run the auth dependency.
+protected = APIRouter(dependencies=[Depends(authenticate_and_rate_limit)])
 
 
 @app.get("/")
@@ -114,12 +151,8 @@ async def usage_options():
     return {}
 
 
-@app.get("/v1/pricing")
-async def get_pricing():
-    """
-    Public pricing information endpoint.
-    Shows available tiers and their limits.
-    """
+def render_pricing() -> bytes:
+    """Serialize the public pricing table (tiers and their limits)."""
     pricing = []
     for tier, limits in TIER_LIMITS.items():
         pricing.append({
@@ -132,7 +165,7 @@ async def get_pricing():
             }
         })
     
-    return {
+    return orjson.dumps({
         "currency": "USD",
         "tiers": pricing,
         "notes": [
@@ -140,10 +173,29 @@ async def get_pricing():
             "Overage charges: $0.001 per request beyond monthly limit",
             "Enterprise tier includes dedicated support and SLA"
         ]
-    }
+    })
+
 
+# Pricing is static, so the body is rendered once at import
+_PRICING_BODY = render_pricing()
 
-@app.post("/v1/keys/create")
+
+def refresh_pricing():
+    """Re-render the pricing body after TIER_LIMITS changes at runtime."""
+    global _PRICING_BODY
+    _PRICING_BODY = render_pricing()
+
+
+@app.get("/v1/pricing")
+async def get_pricing():
+    """
+    Public pricing information endpoint.
+    Shows available tiers and their limits.
+    """
+    return Response(content=_PRICING_BODY, media_type="application/json")
+
+
+@protected.post("/v1/keys/create")
 async def create_api_key(
     user_id: str,
     tier: Tier,
@@ -162,7 +214,8 @@ async def create_api_key(
     
     This is a simplified version for demo purposes.
     """
-    raw_key = api_key_store.create_key(
+    raw_key = await run_store_call(
+        api_key_store.create_key,
         user_id=user_id,
         tier=tier,
         email=email,
@@ -185,40 +238,70 @@ async def create_api_key(
     }
 
 
-@app.get("/v1/usage")
+@protected.get("/v1/usage")
 async def get_usage(http_request: Request):
     """
     Get usage statistics for authenticated API key.
     Requires authentication.
     """
     api_key = http_request.state.api_key
-    limits = TIER_LIMITS[api_key.tier]
+    limits = api_key.limits
+    
+    per_day = limits.requests_per_day
+    per_month = limits.requests_per_month
+    used_today = api_key.requests_today
+    used_month = api_key.requests_this_month
+    last_request_at = api_key.last_request_at
+    
+    overage = used_month - per_month if used_month > per_month else 0
+    overage_cost = overage * 0.001
     
     return {
         "tier": api_key.tier.value,
         "usage": {
-            "requests_today": api_key.requests_today,
-            "requests_this_month": api_key.requests_this_month,
-            "last_request_at": api_key.last_request_at.isoformat() if api_key.last_request_at else None
+            "requests_today": used_today,
+            "requests_this_month": used_month,
+            "last_request_at": datetime.utcfromtimestamp(last_request_at).isoformat() if last_request_at else None
         },
         "limits": {
-            "requests_per_day": limits.requests_per_day,
-            "requests_per_month": limits.requests_per_month
+            "requests_per_day": per_day,
+            "requests_per_month": per_month
         },
         "remaining": {
-            "today": max(0, limits.requests_per_day - api_key.requests_today),
-            "this_month": max(0, limits.requests_per_month - api_key.requests_this_month)
+            "today": per_day - used_today if used_today < per_day else 0,
+            "this_month": per_month - used_month if used_month < per_month else 0
         },
         "estimated_cost_this_month": {
-            "included_requests": limits.requests_per_month,
-            "overage_requests": max(0, api_key.requests_this_month - limits.requests_per_month),
-            "overage_cost_usd": max(0, api_key.requests_this_month - limits.requests_per_month) * 0.001,
-            "total_cost_usd": limits.price_usd + (max(0, api_key.requests_this_month - limits.requests_per_month) * 0.001)
+            "included_requests": per_month,
+            "overage_requests": overage,
+            "overage_cost_usd": overage_cost,
+            "total_cost_usd": limits.price_usd + overage_cost
         }
     }
 
 
-@app.post("/v1/decision", response_model=DecisionResponse)
+# Terminal rule outcomes are fixed (rule + keyword), so each response is built once
+_TERMINAL_RESPONSES: Dict[Tuple[Decision, Priority, str], DecisionResponse] = {}
+
+
+def get_terminal_response(rule: RuleResult) -> DecisionResponse:
+    """Return the cached response for a terminal rule, building it on first use."""
+    key = (rule.decision, rule.priority, rule.reason)
+    response = _TERMINAL_RESPONSES.get(key)
+    
+    if response is None:
+        response = _TERMINAL_RESPONSES[key] = DecisionResponse(
+            decision=rule.decision,
+            priority=rule.priority,
+            churn_risk=0.0,  # Rules don't estimate churn
+            confidence=0.9,  # High confidence in rule-based decisions
+            recommended_action=rule.reason
+        )
+    
+    return response
+
+
+@protected.post("/v1/decision", response_model=DecisionResponse)
 async def make_decision(request: DecisionRequest, http_request: Request) -> DecisionResponse:
     """
     Main decision endpoint - REQUIRES AUTHENTICATION.
@@ -232,7 +315,7 @@ async def make_decision(request: DecisionRequest, http_request: Request) -> Deci
         Headers include: X-RateLimit-* for current usage
     
     Flow:
-    1. Authenticate & rate limit (middleware handles this)
+    1. Authenticate & rate limit (router dependency handles this)
     2. Apply rule engine (terminal rules skip AI)
     3. Call AI for nuanced analysis (if needed)
     4. Merge rule + AI decisions (rules can override)
@@ -244,145 +327,107 @@ async def make_decision(request: DecisionRequest, http_request: Request) -> Deci
     - 401: Authentication failed (invalid/missing API key)
     - 429: Rate limit exceeded (see Retry-After header)
     - 422: Invalid input schema
-    - 500: Internal processing error (with safe fallback)
+    - 500: Internal processing error (unexpected bug; no decision returned)
+    
+    AI failures (timeouts, API errors, bad JSON) are handled inside
+    get_ai_decision, which returns None and triggers the fallback below.
     """
     
-    # Get authenticated API key from request state (set by middleware)
+    # Get authenticated API key from request state (set by auth dependency)
     api_key = http_request.state.api_key
     
-    try:
-        logger.info(
-            f"Processing decision request: "
-            f"plan={request.user_plan.value}, "
-            f"channel={request.channel.value}, "
-            f"tier={api_key.tier.value}"
-        )
-        
-        # STEP 1: Apply rule engine
-        terminal_rule, all_rules = apply_rules(request)
-        
-        # If we have a terminal rule (legal, spam), return immediately
-        if terminal_rule and terminal_rule.is_terminal:
-            logger.info(f"Terminal rule matched: {terminal_rule.reason}")
-            
-            # Build response from rule
-            response = DecisionResponse(
-                decision=terminal_rule.decision,
-                priority=terminal_rule.priority,
-                churn_risk=0.0,  # Rules don't estimate churn
-                confidence=0.9,  # High confidence in rule-based decisions
-                recommended_action=terminal_rule.reason
-            )
-            
-            return response
-        
-        # STEP 2: Call AI for advisory analysis
-        ai_result = await get_ai_decision(request)
-        ai_failed = False
-        
-        if not ai_result:
-            logger.warning("AI decision failed, using fallback")
-            ai_result = get_fallback_decision(request)
-            ai_failed = True
-        
-        # STEP 3: Merge rule constraints with AI decision
-        # Rules can set minimum priority levels
-        final_decision = ai_result.decision
-        final_priority = ai_result.priority
-        
-        # Check if any non-terminal rule sets a minimum decision level
-        for rule in all_rules:
-            if rule.decision:
-                # If rule says "priority_response" and AI says "standard_response",
-                # upgrade to rule's decision
-                decision_hierarchy = [
-                    Decision.IGNORE,
-                    Decision.STANDARD_RESPONSE,
-                    Decision.PRIORITY_RESPONSE,
-                    Decision.IMMEDIATE_ESCALATION
-                ]
-                
-                rule_level = decision_hierarchy.index(rule.decision)
-                ai_level = decision_hierarchy.index(final_decision)
-                
-                if rule_level > ai_level:
-                    final_decision = rule.decision
-                    logger.info(f"Rule upgraded decision: {rule.reason}")
-            
-            if rule.priority:
-                # Similar upgrade logic for priority
-                priority_hierarchy = [
-                    Priority.LOW,
-                    Priority.MEDIUM,
-                    Priority.HIGH,
-                    Priority.CRITICAL
-                ]
-                
-                rule_priority_level = priority_hierarchy.index(rule.priority)
-                current_priority_level = priority_hierarchy.index(final_priority)
-                
-                if rule_priority_level > current_priority_level:
-                    final_priority = rule.priority
-        
-        # STEP 4: Calculate confidence
-        confidence = calculate_confidence(
-            request=request,
-            rule_results=all_rules,
-            ai_result=ai_result,
-            ai_failed=ai_failed
-        )
-        
-        # STEP 5: Apply confidence-based fallback
-        if should_apply_confidence_fallback(confidence):
-            logger.warning(f"Low confidence ({confidence}), applying conservative fallback")
-            
-            # When uncertain, escalate
-            if final_decision == Decision.IGNORE:
-                final_decision = Decision.STANDARD_RESPONSE
-                final_priority = Priority.MEDIUM
-            elif final_decision == Decision.STANDARD_RESPONSE:
-                final_decision = Decision.PRIORITY_RESPONSE
-                final_priority = Priority.HIGH
-            
-            ai_result.recommended_action = f"[Low confidence - review required] {ai_result.recommended_action}"
+    logger.info(
+        "Processing decision request: plan=%s, channel=%s, tier=%s",
+        request.user_plan.value,
+        request.channel.value,
+        api_key.tier.value
+    )
+    
+    # STEP 1: Apply rule engine
+    terminal_rule, all_rules = apply_rules(request)
+    
+    # If we have a terminal rule (legal, spam), return immediately
+    if terminal_rule and terminal_rule.is_terminal:
+        logger.info("Terminal rule matched: %s", terminal_rule.reason)
         
-        # STEP 6: Build final response
-        response = DecisionResponse(
-            decision=final_decision,
-            priority=final_priority,
-            churn_risk=ai_result.churn_risk,
-            confidence=confidence,
-            recommended_action=ai_result.recommended_action
-        )
+        # Build response from rule (prebuilt per rule outcome)
+        return get_terminal_response(terminal_rule)
+    
+    # STEP 2: Call AI for advisory analysis
+    ai_result = await get_ai_decision(request)
+    ai_failed = False
+    
+    if not ai_result:
+        logger.warning("AI decision failed, using fallback")
+        ai_result = get_fallback_decision(request)
+        ai_failed = True
+    
+    # STEP 3: Merge rule constraints with AI decision
+    # Rules can set minimum levels: take the highest of the AI's
+    # choice and every rule's, in a single max() per field
+    final_decision = max(
+        [ai_result.decision, *(rule.decision for rule in all_rules if rule.decision)],
+        key=DECISION_RANK.__getitem__
+    )
+    final_priority = max(
+        [ai_result.priority, *(rule.priority for rule in all_rules if rule.priority)],
+        key=PRIORITY_RANK.__getitem__
+    )
+    
+    if final_decision is not ai_result.decision:
+        logger.info("Rule upgraded decision: %s -> %s", ai_result.decision.value, final_decision.value)
+    
+    # STEP 4: Calculate confidence
+    confidence = calculate_confidence(
+        request=request,
+        rule_results=all_rules,
+        ai_result=ai_result,
+        ai_failed=ai_failed
+    )
+    
+    # STEP 5: Apply confidence-based fallback
+    if should_apply_confidence_fallback(confidence):
+        logger.warning("Low confidence (%s), applying conservative fallback", confidence)
         
-        logger.info(f"Decision complete: {final_decision.value}, priority={final_priority.value}, confidence={confidence}")
+        # When uncertain, escalate
+        if final_decision is Decision.IGNORE:
+            final_decision = Decision.STANDARD_RESPONSE
+            final_priority = Priority.MEDIUM
+        elif final_decision is Decision.STANDARD_RESPONSE:
+            final_decision = Decision.PRIORITY_RESPONSE
+            final_priority = Priority.HIGH
         
-        return response
+        ai_result.recommended_action = f"[Low confidence - review required] {ai_result.recommended_action}"
     
-    except ValidationError as e:
-        # This should rarely happen (Pydantic validates input)
-        logger.error(f"Validation error: {e}")
-        raise HTTPException(status_code=422, detail=str(e))
+    # STEP 6: Build final response
+    response = DecisionResponse(
+        decision=final_decision,
+        priority=final_priority,
+        churn_risk=ai_result.churn_risk,
+        confidence=confidence,
+        recommended_action=ai_result.recommended_action
+    )
     
-    except Exception as e:
-        # Unexpected error - return safe fallback
-        logger.error(f"Unexpected error: {e}", exc_info=True)
-        
-        # Emergency fallback: always safe to escalate when broken
-        return DecisionResponse(
-            decision=Decision.PRIORITY_RESPONSE,
-            priority=Priority.HIGH,
-            churn_risk=0.5,
-            confidence=0.2,
-            recommended_action="System error occurred. Manual review required immediately."
-        )
+    logger.info(
+        "Decision complete: %s, priority=%s, confidence=%s",
+        final_decision.value, final_priority.value, confidence
+    )
+    
+    return response
+
+
+app.include_router(protected)
 
 
 # Exception handlers for better error responses
+app.add_exception_handler(AuthenticationError, authentication_error_handler)
+app.add_exception_handler(RateLimitError, rate_limit_error_handler)
+
+
 @app.exception_handler(ValidationError)
 async def validation_exception_handler(request, exc):
     """Handle Pydantic validation errors gracefully."""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=422,
         content={
             "error": "Invalid request format",
@@ -391,17 +436,27 @@ async def validation_exception_handler(request, exc):
     )
 
 
+# Response for unexpected errors, built once (this path runs at full
+# request rate during an incident). Safe to reuse: Exception handlers run
+# in ServerErrorMiddleware, outside CORSMiddleware and every other
+# middleware, so nothing adds headers to it (500s carry no CORS headers).
+_INTERNAL_ERROR_RESPONSE = Response(
+    content=orjson.dumps({
+        "error": "Internal server error",
+        "message": "An unexpected error occurred. Please retry or contact support."
+    }),
+    status_code=500,
+    media_type="application/json"
+)
+
+
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc):
     """Catch-all handler for unexpected errors."""
-    logger.error(f"Unhandled exception: {exc}", exc_info=True)
-    return JSONResponse(
-        status_code=500,
-        content={
-            "error": "Internal server error",
-            "message": "An unexpected error occurred. Safe fallback applied."
-        }
-    )
+    # One line, no traceback: ServerErrorMiddleware re-raises after this
+    # handler, and the server (uvicorn) logs the full traceback itself
+    logger.error("Unhandled exception: %s", exc)
+    return _INTERNAL_ERROR_RESPONSE
 
 
 if __name__ == "__main__":
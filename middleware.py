@@ -1,17 +1,23 @@
 """
-FastAPI middleware for authentication and rate limiting.
+FastAPI dependency for authentication and rate limiting.
 """
 
-from fastapi import Request, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi import Request, Response, HTTPException, status
 from typing import Optional
+from collections import Counter
+import asyncio
 import logging
+import orjson
 
-from auth import APIKey, api_key_store, verify_api_key_format
+from auth import APIKey, api_key_store, run_store_call, verify_api_key_format, hash_api_key
 from rate_limit import rate_limiter
+import config
 
 logger = logging.getLogger(__name__)
 
+# Usage increments buffered between flushes (key_hash -> requests)
+_pending_usage: Counter = Counter()
+
 
 class AuthenticationError(HTTPException):
     """Custom exception for authentication failures."""
@@ -41,13 +47,17 @@ def extract_api_key(request: Request) -> Optional[str]:
     2. X-API-Key header: sk_live_xxx
     3. Query parameter: ?api_key=sk_live_xxx (not recommended for production)
     """
+    headers = request.headers
+    
     # Try Authorization header (preferred)
-    auth_header = request.headers.get("Authorization")
-    if auth_header and auth_header.startswith("Bearer "):
-        return auth_header.replace("Bearer ", "").strip()
+    auth_header = headers.get("Authorization")
+    if auth_header:
+        auth_header = auth_header.lstrip()
+        if auth_header[:7].lower() == "bearer ":  # Scheme is case-insensitive
+            return auth_header[7:].strip()
     
     # Try X-API-Key header
-    api_key_header = request.headers.get("X-API-Key")
+    api_key_header = headers.get("X-API-Key")
     if api_key_header:
         return api_key_header.strip()
     
@@ -84,8 +94,8 @@ async def authenticate_request(request: Request) -> APIKey:
             "Invalid API key format. Expected: sk_live_xxx or sk_test_xxx"
         )
     
-    # Retrieve key from store
-    api_key = api_key_store.get_key(raw_key)
+    # Retrieve key from store (format already checked above)
+    api_key = await run_store_call(api_key_store.get_key_by_hash, hash_api_key(raw_key))
     
     if not api_key:
         raise AuthenticationError(
@@ -112,86 +122,94 @@ async def check_rate_limits(api_key: APIKey) -> None:
     
     if not allowed:
         logger.warning(
-            f"Rate limit exceeded for key {api_key.key_hash[:8]}... "
-            f"(tier={api_key.tier.value})"
+            "Rate limit exceeded for key %s... (tier=%s)",
+            api_key.key_hash[:8],
+            api_key.tier.value
         )
         raise RateLimitError(error_message, retry_after or 60)
 
 
-async def auth_middleware(request: Request, call_next):
+async def authenticate_and_rate_limit(request: Request, response: Response) -> APIKey:
     """
-    Middleware to authenticate requests and enforce rate limits.
+    Dependency that authenticates requests and enforces rate limits.
+    
+    Attached to the protected router in main.py, so public endpoints
+    (/, /health, docs, pricing) and CORS preflights never run it.
     
     Workflow:
-    1. Check if endpoint requires authentication
-    2. Extract and validate API key
-    3. Check rate limits
-    4. Update usage counters
+    1. Extract and validate API key
+    2. Check rate limits
+    3. Buffer usage counters (flushed every USAGE_FLUSH_INTERVAL_SECONDS)
+    4. Store API key in request state for endpoint access
     5. Add rate limit headers to response
-    6. Call next middleware/endpoint
     """
-    # CRITICAL FIX: Allow OPTIONS requests (CORS preflight) without authentication
-    if request.method == "OPTIONS":
-        response = await call_next(request)
-        return response
+    # Authenticate
+    api_key = await authenticate_request(request)
     
-    # Skip authentication for public endpoints
-    public_paths = ["/", "/health", "/docs", "/openapi.json", "/redoc", "/v1/pricing"]
-    if request.url.path in public_paths:
-        return await call_next(request)
+    # Check rate limits
+    await check_rate_limits(api_key)
     
-    try:
-        # Authenticate
-        api_key = await authenticate_request(request)
-        
-        # Check rate limits
-        await check_rate_limits(api_key)
-        
-        # Update usage counters
-        api_key_store.update_usage(api_key.key_hash)
-        
-        # Store API key in request state for endpoint access
-        request.state.api_key = api_key
-        
-        # Process request
-        response = await call_next(request)
-        
-        # Add rate limit headers to response
-        headers = rate_limiter.get_rate_limit_headers(api_key)
-        for key, value in headers.items():
-            response.headers[key] = value
-        
-        return response
-        
-    except AuthenticationError as e:
-        return JSONResponse(
-            status_code=e.status_code,
-            content={
-                "error": "authentication_failed",
-                "message": e.detail,
-                "docs": "https://docs.yourapi.com/authentication"
-            },
-            headers=e.headers
-        )
+    # Count usage; flush_usage_loop writes it to the key store in batches
+    _pending_usage[api_key.key_hash] += 1
     
-    except RateLimitError as e:
-        return JSONResponse(
-            status_code=e.status_code,
-            content={
-                "error": "rate_limit_exceeded",
-                "message": e.detail,
-                "retry_after": e.headers.get("Retry-After"),
-                "docs": "https://docs.yourapi.com/rate-limits"
-            },
-            headers=e.headers
-        )
+    # Store API key in request state for endpoint access
+    request.state.api_key = api_key
     
-    except Exception as e:
-        logger.error(f"Unexpected error in auth middleware: {e}", exc_info=True)
-        return JSONResponse(
-            status_code=500,
-            content={
-                "error": "internal_error",
-                "message": "An unexpected error occurred during authentication"
-            }
-        )
\ No newline at end of file
+    # Add rate limit headers (FastAPI copies them onto the endpoint's response)
+    response.raw_headers.extend(rate_limiter.get_rate_limit_headers(api_key))
+    
+    return api_key
+
+
+# Error bodies with the static parts serialized once; only the message
+# (and retry_after) are filled in per response, JSON-escaped by orjson
+_AUTH_ERROR_BODY = b'{"error":"authentication_failed","message":%s,"docs":"https://docs.yourapi.com/authentication"}'
+_RATE_LIMIT_ERROR_BODY = b'{"error":"rate_limit_exceeded","message":%s,"retry_after":%s,"docs":"https://docs.yourapi.com/rate-limits"}'
+
+
+async def flush_usage():
+    """Write buffered usage increments to the key store."""
+    if not _pending_usage:
+        return
+    
+    counts = dict(_pending_usage)
+    _pending_usage.clear()
+    
+    try:
+        await run_store_call(api_key_store.bulk_update_usage, counts)
+    except Exception:
+        _pending_usage.update(counts)  # Keep them for the next flush
+        raise
+
+
+async def flush_usage_loop():
+    """Background task: flush buffered usage every USAGE_FLUSH_INTERVAL_SECONDS."""
+    while True:
+        await asyncio.sleep(config.USAGE_FLUSH_INTERVAL_SECONDS)
+        try:
+            await flush_usage()
+        except Exception as e:
+            logger.error("Usage flush failed: %s", e)
+
+
+async def authentication_error_handler(request: Request, exc: AuthenticationError) -> Response:
+    """Render AuthenticationError raised by authenticate_and_rate_limit."""
+    return Response(
+        content=_AUTH_ERROR_BODY % orjson.dumps(exc.detail),
+        status_code=exc.status_code,
+        media_type="application/json",
+        headers=exc.headers
+    )
+
+
+async def rate_limit_error_handler(request: Request, exc: RateLimitError) -> Response:
+    """Render RateLimitError raised by authenticate_and_rate_limit."""
+    return Response(
+        content=_RATE_LIMIT_ERROR_BODY % (
+            orjson.dumps(exc.detail),
+            orjson.dumps(exc.headers.get("Retry-After"))
+        ),
+        status_code=exc.status_code,
+        media_type="application/json",
+        headers=exc.headers
+    )
@@ -35,6 +35,22 @@ class Priority(str, Enum):
     CRITICAL = "critical"
 
 
+# Escalation order (lowest → highest), used to merge rule and AI decisions
+DECISION_RANK = {
+    Decision.IGNORE: 0,
+    Decision.STANDARD_RESPONSE: 1,
+    Decision.PRIORITY_RESPONSE: 2,
+    Decision.IMMEDIATE_ESCALATION: 3,
+}
+
+PRIORITY_RANK = {
+    Priority.LOW: 0,
+    Priority.MEDIUM: 1,
+    Priority.HIGH: 2,
+    Priority.CRITICAL: 3,
+}
+
+
 class DecisionRequest(BaseModel):
     """Incoming customer message with context."""
     message: str = Field(..., min_length=1, max_length=5000)
@@ -50,6 +66,14 @@ class DecisionRequest(BaseModel):
             raise ValueError("Message cannot be empty or whitespace only")
         return v.strip()
 
+    @field_validator('user_plan', 'channel', mode='before')
+    @classmethod
+    def default_if_null(cls, v, info):
+        """Treat an explicit null as "not provided" (downstream code reads .value)."""
+        if v is None:
+            return cls.model_fields[info.field_name].default
+        return v
+
 
 class DecisionResponse(BaseModel):
     """Strict output schema - no deviation allowed."""
@@ -3,12 +3,112 @@ Rule engine - runs BEFORE AI to catch critical cases.
 These rules are non-negotiable business logic.
 """
 
-from typing import Optional, Tuple
-from models import DecisionRequest, Decision, Priority
+from typing import Optional, Tuple, Dict, List, Callable
+from models import DecisionRequest, Decision, Priority, UserPlan
 import config
 import re
 
 
+# Keyword categories matched by the rule engine
+LEGAL = "legal"
+SPAM = "spam"
+THREAT = "threat"
+
+KEYWORD_CATEGORIES: Dict[str, set] = {
+    LEGAL: config.LEGAL_KEYWORDS,
+    SPAM: config.SPAM_INDICATORS,
+    THREAT: config.THREAT_KEYWORDS,
+}
+
+
+def _build_keyword_automaton():
+    """
+    Compile all keyword sets into one Aho-Corasick automaton.
+    Optional: pip install pyahocorasick (falls back to compiled regexes).
+    """
+    try:
+        import ahocorasick
+    except ImportError:
+        return None
+    
+    automaton = ahocorasick.Automaton()
+    for category, keywords in KEYWORD_CATEGORIES.items():
+        for keyword in keywords:
+            automaton.add_word(keyword, (category, keyword))
+    automaton.make_automaton()
+    
+    return automaton
+
+
+def _compile_keywords(keywords: set) -> re.Pattern:
+    """
+    Compile keywords into one alternation, matched against the
+    lowercased message (same normalisation as the automaton path).
+    Longest first, wrapped in a lookahead so overlapping keywords
+    at different positions are all reported by finditer().
+    Only the longest keyword per position matches; see _keyword_prefixes.
+    """
+    alternation = "|".join(
+        re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True)
+    )
+    return re.compile(f"(?=({alternation}))")
+
+
+def _keyword_prefixes(keywords: set) -> Dict[str, Tuple[str, ...]]:
+    """
+    Map each keyword to every keyword that is a prefix of it (itself included).
+    A regex match on "cancelling" also means "cancel" starts there, which
+    the automaton reports separately; expanding matches keeps both in step.
+    """
+    return {
+        keyword: tuple(other for other in keywords if keyword.startswith(other))
+        for keyword in keywords
+    }
+
+
+_KEYWORD_AUTOMATON = _build_keyword_automaton()
+
+LEGAL_RE = _compile_keywords(config.LEGAL_KEYWORDS)
+SPAM_RE = _compile_keywords(config.SPAM_INDICATORS)
+THREAT_RE = _compile_keywords(config.THREAT_KEYWORDS)
+
+KEYWORD_PATTERNS: Dict[str, re.Pattern] = {
+    LEGAL: LEGAL_RE,
+    SPAM: SPAM_RE,
+    THREAT: THREAT_RE,
+}
+
+KEYWORD_PREFIXES: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    category: _keyword_prefixes(keywords)
+    for category, keywords in KEYWORD_CATEGORIES.items()
+}
+
+
+def scan_keywords(message: str) -> Dict[str, List[str]]:
+    """
+    Find every keyword in the message, grouped by category.
+    Uses the Aho-Corasick automaton if installed, otherwise the
+    precompiled regexes (matching runs in C either way).
+    """
+    hits: Dict[str, List[str]] = {category: [] for category in KEYWORD_CATEGORIES}
+    
+    message_lower = message.lower()
+    
+    if _KEYWORD_AUTOMATON is not None:
+        for _, (category, keyword) in _KEYWORD_AUTOMATON.iter(message_lower):
+            hits[category].append(keyword)
+    else:
+        for category, pattern in KEYWORD_PATTERNS.items():
+            prefixes = KEYWORD_PREFIXES[category]
+            hits[category] = [
+                keyword
+                for match in pattern.finditer(message_lower)
+                for keyword in prefixes[match.group(1)]
+            ]
+    
+    return hits
+
+
 class RuleResult:
     """Result from rule engine evaluation."""
     def __init__(
@@ -26,34 +126,36 @@ class RuleResult:
         self.is_terminal = is_terminal  # If True, skip AI entirely
 
 
-def check_legal_escalation(message: str) -> Optional[RuleResult]:
+def check_legal_escalation(
+    request: DecisionRequest,
+    keyword_hits: Dict[str, List[str]]
+) -> Optional[RuleResult]:
     """
     CRITICAL RULE: Legal keywords → immediate escalation.
     This protects the company and must run first.
     """
-    message_lower = message.lower()
-    
-    for keyword in config.LEGAL_KEYWORDS:
-        if keyword in message_lower:
-            return RuleResult(
-                decision=Decision.IMMEDIATE_ESCALATION,
-                priority=Priority.CRITICAL,
-                confidence_boost=0.3,
-                reason=f"Legal keyword detected: '{keyword}'",
-                is_terminal=True  # Skip AI, escalate now
-            )
+    legal_hits = keyword_hits[LEGAL]
+    if legal_hits:
+        return RuleResult(
+            decision=Decision.IMMEDIATE_ESCALATION,
+            priority=Priority.CRITICAL,
+            confidence_boost=0.3,
+            reason=f"Legal keyword detected: '{legal_hits[0]}'",
+            is_terminal=True  # Skip AI, escalate now
+        )
     return None
 
 
-def check_spam_or_noise(message: str) -> Optional[RuleResult]:
+def check_spam_or_noise(
+    request: DecisionRequest,
+    keyword_hits: Dict[str, List[str]]
+) -> Optional[RuleResult]:
     """
     Detect low-signal messages (spam, very short, promotional).
     Save processing costs by filtering these early.
     """
-    message_clean = message.strip()
-    
-    # Too short to be meaningful
-    if len(message_clean) < config.MIN_MESSAGE_LENGTH:
+    # Too short to be meaningful (message is already stripped by DecisionRequest)
+    if len(request.message) < config.MIN_MESSAGE_LENGTH:
         return RuleResult(
             decision=Decision.IGNORE,
             priority=Priority.LOW,
@@ -63,35 +165,32 @@ def check_spam_or_noise(message: str) -> Optional[RuleResult]:
         )
     
     # Spam indicators
-    message_lower = message_clean.lower()
-    for spam_word in config.SPAM_INDICATORS:
-        if spam_word in message_lower:
-            return RuleResult(
-                decision=Decision.IGNORE,
-                priority=Priority.LOW,
-                confidence_boost=0.15,
-                reason=f"Spam indicator detected: '{spam_word}'",
-                is_terminal=True
-            )
+    spam_hits = keyword_hits[SPAM]
+    if spam_hits:
+        return RuleResult(
+            decision=Decision.IGNORE,
+            priority=Priority.LOW,
+            confidence_boost=0.15,
+            reason=f"Spam indicator detected: '{spam_hits[0]}'",
+            is_terminal=True
+        )
     
     return None
 
 
-def check_enterprise_sentiment(request: DecisionRequest) -> Optional[RuleResult]:
+def check_enterprise_sentiment(
+    request: DecisionRequest,
+    keyword_hits: Dict[str, List[str]]
+) -> Optional[RuleResult]:
     """
     Enterprise customers with negative signals get priority treatment.
     This is business logic: we can't afford to lose enterprise accounts.
     """
-    if request.user_plan.value != "enterprise":
+    if request.user_plan is not UserPlan.ENTERPRISE:
         return None
     
-    message_lower = request.message.lower()
-    
-    # Check for churn/threat signals
-    negative_signals = 0
-    for keyword in config.THREAT_KEYWORDS:
-        if keyword in message_lower:
-            negative_signals += 1
+    # Check for churn/threat signals (distinct keywords)
+    negative_signals = len(set(keyword_hits[THREAT]))
     
     if negative_signals > 0:
         return RuleResult(
@@ -105,33 +204,59 @@ def check_enterprise_sentiment(request: DecisionRequest) -> Optional[RuleResult]
     return None
 
 
-def check_history_patterns(request: DecisionRequest) -> Optional[RuleResult]:
+def check_history_patterns(
+    request: DecisionRequest,
+    keyword_hits: Optional[Dict[str, List[str]]] = None
+) -> Optional[RuleResult]:
     """
     If customer has history of issues, boost priority.
     Multiple complaints = higher risk.
     """
-    if not request.history or len(request.history) == 0:
+    if not request.history:
         return None
     
     # Simple heuristic: lots of history = engaged user (for better or worse)
     history_count = len(request.history)
     
-    if history_count >= 5:
-        return RuleResult(
-            confidence_boost=0.15,
-            reason=f"Customer has {history_count} previous interactions",
-            is_terminal=False
-        )
-    elif history_count >= 3:
-        return RuleResult(
-            confidence_boost=0.1,
-            reason=f"Customer has {history_count} previous interactions",
-            is_terminal=False
-        )
+    for min_count, boost in config.HISTORY_CONFIDENCE_TIERS:
+        if history_count >= min_count:
+            return RuleResult(
+                confidence_boost=boost,
+                reason=f"Customer has {history_count} previous interactions",
+                is_terminal=False
+            )
     
     return None
 
 
+# Signature shared by all rules in a pipeline
+RuleCheck = Callable[[DecisionRequest, Dict[str, List[str]]], Optional[RuleResult]]
+
+# Rule pipelines specialized per plan (see _rule_pipeline)
+_RULE_PIPELINES: Dict[Optional[UserPlan], Tuple[RuleCheck, ...]] = {}
+
+
+def _rule_pipeline(plan: Optional[UserPlan]) -> Tuple[RuleCheck, ...]:
+    """
+    Rules that can fire for this plan, in priority order.
+    Built once per plan so non-enterprise requests never
+    evaluate enterprise-only rules.
+    """
+    pipeline = _RULE_PIPELINES.get(plan)
+    if pipeline is None:
+        checks: List[RuleCheck] = [
+            check_legal_escalation,    # Rule 1: Legal (highest priority, terminal)
+            check_spam_or_noise,       # Rule 2: Spam/noise (terminal if matched)
+        ]
+        if plan is UserPlan.ENTERPRISE:
+            checks.append(check_enterprise_sentiment)  # Rule 3: Sets minimum priority
+        checks.append(check_history_patterns)          # Rule 4: Boosts confidence
+        
+        pipeline = _RULE_PIPELINES[plan] = tuple(checks)
+    
+    return pipeline
+
+
 def apply_rules(request: DecisionRequest) -> Tuple[Optional[RuleResult], list[RuleResult]]:
     """
     Apply all rules in priority order.
@@ -142,29 +267,15 @@ def apply_rules(request: DecisionRequest) -> Tuple[Optional[RuleResult], list[Ru
     """
     results = []
     
-    # Rule 1: Legal (highest priority, terminal)
-    legal_result = check_legal_escalation(request.message)
-    if legal_result:
-        results.append(legal_result)
-        if legal_result.is_terminal:
-            return legal_result, results
-    
-    # Rule 2: Spam/noise (terminal if matched)
-    spam_result = check_spam_or_noise(request.message)
-    if spam_result:
-        results.append(spam_result)
-        if spam_result.is_terminal:
-            return spam_result, results
-    
-    # Rule 3: Enterprise sentiment (sets minimum priority)
-    enterprise_result = check_enterprise_sentiment(request)
-    if enterprise_result:
-        results.append(enterprise_result)
-    
-    # Rule 4: History patterns (boost confidence)
-    history_result = check_history_patterns(request)
-    if history_result:
-        results.append(history_result)
+    # Scan keywords once for all rules
+    keyword_hits = scan_keywords(request.message)
+    
+    for check in _rule_pipeline(request.user_plan):
+        result = check(request, keyword_hits)
+        if result:
+            results.append(result)
+            if result.is_terminal:
+                return result, results
     
     # No terminal rule matched - proceed to AI
-    return None, results
\ No newline at end of file
+    return None, results
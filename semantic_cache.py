@@ -0,0 +1,167 @@
+"""
+Semantic decision cache - reuses AI decisions for near-duplicate messages.
+Paraphrases ("I want my money back" / "please refund me") skip the AI call.
+
+Optional layer: requires sentence-transformers.
+    pip install sentence-transformers
+Enable with SEMANTIC_CACHE_ENABLED in config.py. The model is loaded at
+startup (load()) and inference runs on the default executor, so neither
+blocks the event loop.
+"""
+
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Any
+
+from models import DecisionRequest
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class _Partition:
+    """
+    Embeddings + results for one (plan, channel, history) context.
+
+    The vector matrix starts small and doubles as entries arrive (up to
+    max_entries), so the many rarely-used partitions stay tiny.
+    """
+
+    INITIAL_CAPACITY = 64
+
+    def __init__(self, np, dim: int, max_entries: int):
+        self._np = np
+        self.max_entries = max_entries
+        capacity = min(self.INITIAL_CAPACITY, max_entries)
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.results: List[Any] = []
+        self.next_slot = 0  # Ring buffer: oldest entry is overwritten first
+
+    def ensure_slot(self, slot: int):
+        """Grow the vector matrix (doubling) until it has room for slot."""
+        capacity = self.vectors.shape[0]
+        if slot < capacity:
+            return
+
+        while capacity <= slot:
+            capacity = min(capacity * 2, self.max_entries)
+        grown = self._np.zeros((capacity, self.vectors.shape[1]), dtype=self.vectors.dtype)
+        grown[:len(self.vectors)] = self.vectors
+        self.vectors = grown
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache over L2-normalized message embeddings.
+
+    Cosine similarity is a dot product on normalized vectors, so lookup is
+    a single matrix-vector product per partition. Partitions are small and
+    bounded, so a flat scan is fast enough without a vector index.
+
+    Entries are partitioned by plan, channel and history size so a decision
+    made for one customer context is never reused for another.
+    """
+
+    def __init__(self, model_name: str, threshold: float, max_entries: int):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.enabled = config.SEMANTIC_CACHE_ENABLED
+
+        self._np = None
+        self._model = None
+        self._partitions: Dict[Tuple[str, str, int], _Partition] = {}
+        self._embed = lru_cache(maxsize=max_entries)(self._encode)
+
+    async def load(self):
+        """Load the embedding model in a worker thread (called at startup)."""
+        if self.enabled:
+            await asyncio.to_thread(self._load_model)
+
+    def _load_model(self) -> bool:
+        """Load the embedding model. Disables the cache if unavailable."""
+        if self._model is not None:
+            return True
+
+        try:
+            import numpy
+            from sentence_transformers import SentenceTransformer
+
+            self._np = numpy
+            self._model = SentenceTransformer(self.model_name)
+            return True
+
+        except ImportError:
+            logger.error("sentence-transformers not installed. Run: pip install sentence-transformers")
+        except Exception as e:
+            logger.error("Failed to load embedding model %s: %s", self.model_name, e)
+
+        self.enabled = False
+        return False
+
+    def _encode(self, message: str):
+        """Embed a message (normalized, so dot product = cosine similarity)."""
+        return self._model.encode(message, normalize_embeddings=True)
+
+    @staticmethod
+    def _partition_key(request: DecisionRequest) -> Tuple[str, str, int]:
+        return (
+            request.user_plan.value,
+            request.channel.value,
+            len(request.history) if request.history else 0
+        )
+
+    async def lookup(self, request: DecisionRequest) -> Optional[Any]:
+        """Return a copy of the closest cached result above threshold, or None."""
+        if not self.enabled or self._model is None:
+            return None
+
+        partition = self._partitions.get(self._partition_key(request))
+        if partition is None or not partition.results:
+            return None
+
+        embedding = await asyncio.to_thread(self._embed, request.message)
+        count = len(partition.results)
+        scores = partition.vectors[:count] @ embedding
+        best = int(scores.argmax())
+
+        if scores[best] > self.threshold:
+            return partition.results[best].copy()
+
+        return None
+
+    async def store(self, request: DecisionRequest, result: Any):
+        """Add a decision for this message's embedding."""
+        if not self.enabled or self._model is None:
+            return
+
+        embedding = await asyncio.to_thread(self._embed, request.message)
+        key = self._partition_key(request)
+
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = _Partition(self._np, embedding.shape[0], self.max_entries)
+            self._partitions[key] = partition
+
+        slot = partition.next_slot
+        partition.ensure_slot(slot)
+        partition.vectors[slot] = embedding
+        if slot < len(partition.results):
+            partition.results[slot] = result.copy()
+        else:
+            partition.results.append(result.copy())
+
+        partition.next_slot = (slot + 1) % self.max_entries
+
+    def clear(self):
+        """Drop all cached decisions."""
+        self._partitions.clear()
+
+
+# Global semantic cache instance
+semantic_cache = SemanticCache(
+    model_name=config.SEMANTIC_CACHE_MODEL,
+    threshold=config.SEMANTIC_CACHE_THRESHOLD,
+    max_entries=config.SEMANTIC_CACHE_MAX_ENTRIES
+)
@@ -5,15 +5,15 @@ Run this to automatically create all necessary files
 
 import os
 import sys
+from pathlib import Path
 
 def create_file(filename, content):
     """Create a file with given content"""
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(content)
+        Path(filename).write_text(content, encoding='utf-8')
         print(f"✓ Created {filename}")
         return True
-    except Exception as e:
+    except OSError as e:
         print(f"✗ Failed to create {filename}: {e}")
         return False
 
@@ -35,13 +35,20 @@ Decision Intelligence API - Minimal Version
 This is a simplified version to get you started quickly.
 """
 
+import re
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+
+# Legal keywords, matched as whole words in one case-insensitive pass
+LEGAL_RE = re.compile(r"\\b(lawsuit|lawyer|sue|attorney)\\b", re.IGNORECASE)
 
 app = FastAPI(
     title="Decision Intelligence API",
     description="AI-powered customer message triage",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse  # orjson serializes responses in C
 )
 
 # Enable CORS for browser testing
@@ -51,6 +58,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=86400,  # Let browsers cache preflights for 24h
 )
 
 @app.get("/")
@@ -78,8 +86,7 @@ def make_decision(request: dict):
     message = request.get("message", "")
     
     # Simple rule: check for legal keywords
-    legal_keywords = ["lawsuit", "lawyer", "sue", "attorney"]
-    if any(keyword in message.lower() for keyword in legal_keywords):
+    if LEGAL_RE.search(message):
         return {
             "decision": "immediate_escalation",
             "priority": "critical",
@@ -108,6 +115,7 @@ uvicorn[standard]==0.27.0
 pydantic==2.5.3
 google-generativeai==0.3.2
 python-multipart==0.0.6
+orjson==3.9.10
 '''
     
     # Create .gitignore
@@ -242,13 +250,18 @@ uvicorn main:app --reload
     print("Creating files...")
     print()
     
+    files = {
+        "main.py": main_py,
+        "requirements.txt": requirements,
+        ".gitignore": gitignore,
+        "README.md": readme,
+        "test_api.py": test_script,
+        "run.bat": run_bat,
+    }
+    
     success = True
-    success &= create_file("main.py", main_py)
-    success &= create_file("requirements.txt", requirements)
-    success &= create_file(".gitignore", gitignore)
-    success &= create_file("README.md", readme)
-    success &= create_file("test_api.py", test_script)
-    success &= create_file("run.bat", run_bat)
+    for filename, content in files.items():
+        success &= create_file(filename, content)
     
     print()
     
@@ -4,11 +4,15 @@ CORS Test Script - Verify CORS is working correctly
 Run this after starting the API server
 """
 
+import orjson
 import requests
 
 API_BASE = "http://localhost:8000"
 ORIGIN = "http://127.0.0.1:5500"
 
+# One session for all tests: reuses the connection (keep-alive)
+session = requests.Session()
+
 print("=" * 60)
 print("Testing CORS Configuration")
 print("=" * 60)
@@ -17,7 +21,7 @@ print()
 # Test 1: OPTIONS preflight request
 print("1. Testing OPTIONS preflight request...")
 try:
-    response = requests.options(
+    response = session.options(
         f"{API_BASE}/v1/decision",
         headers={
             "Origin": ORIGIN,
@@ -30,6 +34,7 @@ try:
     print(f"   Access-Control-Allow-Origin: {response.headers.get('Access-Control-Allow-Origin', 'MISSING')}")
     print(f"   Access-Control-Allow-Methods: {response.headers.get('Access-Control-Allow-Methods', 'MISSING')}")
     print(f"   Access-Control-Allow-Headers: {response.headers.get('Access-Control-Allow-Headers', 'MISSING')}")
+    print(f"   Access-Control-Max-Age: {response.headers.get('Access-Control-Max-Age', 'MISSING')}")
     
     if response.status_code == 200 and response.headers.get('Access-Control-Allow-Origin'):
         print("   ✅ OPTIONS request successful!")
@@ -45,7 +50,7 @@ print("2. Testing POST request with authentication...")
 API_KEY = "sk_test_demo_pro_key_123456789012345678"
 
 try:
-    response = requests.post(
+    response = session.post(
         f"{API_BASE}/v1/decision",
         headers={
             "Authorization": f"Bearer {API_KEY}",
@@ -63,7 +68,7 @@ try:
     print(f"   Access-Control-Allow-Origin: {response.headers.get('Access-Control-Allow-Origin', 'MISSING')}")
     
     if response.status_code == 200:
-        data = response.json()
+        data = orjson.loads(response.content)
         print(f"   Decision: {data.get('decision')}")
         print(f"   Priority: {data.get('priority')}")
         print("   ✅ POST request successful!")
@@ -77,7 +82,7 @@ print()
 # Test 3: Health check (public endpoint)
 print("3. Testing health endpoint (no auth)...")
 try:
-    response = requests.get(
+    response = session.get(
         f"{API_BASE}/health",
         headers={"Origin": ORIGIN}
     )
@@ -101,4 +106,4 @@ print("If all tests passed, your browser should work correctly.")
 print("If tests failed, check:")
 print("  1. API server is running (uvicorn main:app --reload)")
 print("  2. main.py has updated CORS configuration")
-print("  3. middleware.py allows OPTIONS requests")
\ No newline at end of file
+print("  3. OPTIONS routes are registered on app, not the protected router")
\ No newline at end of file
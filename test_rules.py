@@ -0,0 +1,63 @@
+"""
+Rule engine keyword scanning tests.
+Run with: pytest test_rules.py
+"""
+
+import pytest
+
+import rules
+from models import DecisionRequest, UserPlan
+
+
+@pytest.fixture
+def regex_scan(monkeypatch):
+    """Force the regex backend (used when pyahocorasick isn't installed)."""
+    monkeypatch.setattr(rules, "_KEYWORD_AUTOMATON", None)
+    return rules.scan_keywords
+
+
+def substring_hits(message: str) -> dict:
+    """Reference result: every keyword at every position of the lowercased message."""
+    message_lower = message.lower()
+    return {
+        category: sorted(
+            keyword
+            for keyword in keywords
+            for start in range(len(message_lower))
+            if message_lower.startswith(keyword, start)
+        )
+        for category, keywords in rules.KEYWORD_CATEGORIES.items()
+    }
+
+
+@pytest.mark.parametrize("message", [
+    "I am CANCELLING today, then I'll cancel again",
+    "Disappointed, switching to a competitor. Refund and unsubscribe!",
+    "Our lawyer will SUE you in court",
+])
+def test_regex_scan_reports_prefix_overlaps(regex_scan, message):
+    hits = regex_scan(message)
+    assert {category: sorted(found) for category, found in hits.items()} == substring_hits(message)
+
+
+def test_regex_scan_counts_prefix_keyword_for_enterprise(regex_scan):
+    request = DecisionRequest(message="We are cancelling our plan", user_plan=UserPlan.ENTERPRISE)
+    hits = regex_scan(request.message)
+
+    assert sorted(hits[rules.THREAT]) == ["cancel", "cancelling"]
+    assert "2 negative signal(s)" in rules.check_enterprise_sentiment(request, hits).reason
+
+
+@pytest.mark.parametrize("message", [
+    "I will ſue you now",        # LATIN SMALL LETTER LONG S: case-folds to 's'
+    "Contact our Kelvin lawyer",  # KELVIN SIGN: lowercases to 'k'
+])
+def test_regex_scan_handles_non_ascii_case_folding(regex_scan, message):
+    hits = regex_scan(message)
+    assert {category: sorted(found) for category, found in hits.items()} == substring_hits(message)
+
+
+def test_apply_rules_non_ascii_message_does_not_raise(regex_scan):
+    # Same result as the automaton / substring check: no legal keyword
+    terminal, _ = rules.apply_rules(DecisionRequest(message="I will \u017fue you now, ok?"))
+    assert terminal is None